@@ -31,7 +31,10 @@
 #########################################################################
 
 import os.path as path
+from pathlib import Path
+import re
 import math
+import numpy as np
 
 # Input data
 # ==========
@@ -89,8 +92,41 @@ visc_dyn = max(alpha / 8.0 * refd * hfac * dr * cs, visc_dyn)
 
 # Particles generation
 # ====================
+# Fields: r, normal, u, dudt, rho, drhodt, m0, imove, ilevel, miter
+# AQUAgpusph loads the fields as single precision floats, which are exactly
+# recovered from 9 significant digits, so there is no point in writing more
+FMT = ("%.9g %.9g, %.9g %.9g, %.9g %.9g, %.9g %.9g, "
+       "%.9g, %.9g, %.9g, %d, %d, %d")
+
+
+def writeParticles(output, x, y, normal_x=0.0, normal_y=0.0, vx=0.0, vy=0.0,
+                   dens=refd, mass=0.0, imove=1, level=0):
+    """ Write a block of particles. Each field can be either an array, with
+    a value per particle, or a scalar shared by all the particles
+    :return Number of written particles
+    """
+    fields = np.broadcast_arrays(x, y,
+                                 normal_x, normal_y,
+                                 vx, vy,
+                                 0.0, 0.0,
+                                 dens,
+                                 0.0,
+                                 mass,
+                                 imove,
+                                 level,
+                                 m_iters)
+    fields = np.column_stack(fields).astype(np.float32)
+    np.savetxt(output, fields, fmt=FMT)
+    return len(fields)
+
+
+# All the particles start at the background pressure, so the equation of state
+# gives the same density for all of them
+press = p0
+dens = refd + (press - p0) / cs**2
+
 print("Opening fluid particles output file...")
-output = open("Fluid.dat", "w")
+output = open("Fluid.dat", "w", buffering=1 << 20)
 string = """#############################################################
 #                                                           #
 #    #    ##   #  #   #                           #         #
@@ -112,133 +148,87 @@ string = """
 """
 print(string)
 
-n = 0
-Percentage = -1
-x = -0.5 * dr - sep * h
-while x <= L + sep * h + 0.5 * dr:
-    percentage = int(round((x + sep * h) / (L + 2.0 * sep * h + dr) * 100))
-    if Percentage != percentage:
-        Percentage = percentage
-        if not Percentage % 10:
-            string = '    {}%'.format(Percentage)
-            print(string)
-    y = -0.5 * H + 0.5 * dr
-    while y < 0.5 * H:
-        level = 0
-        if (x - refine1_center[0])**2 + (y - refine1_center[1])**2 <= \
-           refine1_radius**2:
-            level = 1
-        if (x - refine2_center[0])**2 + (y - refine2_center[1])**2 <= \
-           refine2_radius**2:
-            level = 2
-        for ix in range(2**level):
-            xx = x - 0.5 * dr + (ix + 0.5) * dr / (2**level)
-            for iy in range(2**level):
-                yy = y - 0.5 * dr + (iy + 0.5) * dr / (2**level)
-                # Avoid the particles inside the cylinder
-                dist = math.sqrt((xx - x_cyl)**2 + (yy - y_cyl)**2)
-                if dist < 0.5 * (D + dr / (2**level)):
-                    continue
+# Number of columns of particles, from x = -0.5 dr - sep h to
+# x = L + sep h + 0.5 dr
+nx = int(math.floor((L + 2.0 * sep * h + dr) / dr + 1.0e-6)) + 1
 
-                n += 1
-                imove = 1
-                vx = 0.0
-                vy = 0.0
-                press = p0
-                dens = refd + (press - p0) / cs**2
-                mass = refd * (dr / (2**level))**2.0
-                string = ("{} {}, " * 4 + "{}, {}, {}, {}, {}, {}\n").format(
-                    xx, yy,
-                    0.0, 0.0,
-                    vx, vy,
-                    0.0, 0.0,
-                    dens,
-                    0.0,
-                    mass,
-                    imove,
-                    level,
-                    m_iters)
-                output.write(string)
-        y += dr
-    x += dr
+n = 0
+x = -0.5 * dr - sep * h + np.arange(nx) * dr
+y = -0.5 * H + (np.arange(ny) + 0.5) * dr
+x, y = np.meshgrid(x, y, indexing='ij')
+x = x.ravel()
+y = y.ravel()
+# The cells just on the refinement circles are refined, regardless of the
+# round-off errors
+tol = 1.0e-3 * dr
+levels = np.zeros(x.shape, dtype=int)
+levels[(x - refine1_center[0])**2 + (y - refine1_center[1])**2 <=
+       (refine1_radius + tol)**2] = 1
+levels[(x - refine2_center[0])**2 + (y - refine2_center[1])**2 <=
+       (refine2_radius + tol)**2] = 2
+for level in range(3):
+    # Split each cell in 2^level x 2^level subparticles
+    ddr = dr / (2**level)
+    offset = (np.arange(2**level) + 0.5) * ddr - 0.5 * dr
+    offset_x, offset_y = np.meshgrid(offset, offset, indexing='ij')
+    cells = levels == level
+    xx = (x[cells, np.newaxis] + offset_x.ravel()).ravel()
+    yy = (y[cells, np.newaxis] + offset_y.ravel()).ravel()
+    # Avoid the particles inside the cylinder
+    dist = np.sqrt((xx - x_cyl)**2 + (yy - y_cyl)**2)
+    mask = dist >= 0.5 * (D + ddr)
+    n_level = writeParticles(output, xx[mask], yy[mask],
+                             dens=dens,
+                             mass=refd * ddr**2.0,
+                             imove=1,
+                             level=level)
+    print('    level {}: {} particles'.format(level, n_level))
+    n += n_level
 
 string = """
     Writing the symmetry elements and dummy particles...
 """
 print(string)
 
-Percentage = -1
-x = -0.5 * dr - sep * h
-while x <= L + sep * h + 0.5 * dr:
-    percentage = int(round((x + sep * h) / (L + 2.0 * sep * h + dr) * 100))
-    if Percentage != percentage:
-        Percentage = percentage
-        if not Percentage % 10:
-            string = '    {}%'.format(Percentage)
-            print(string)
-    for i, y in enumerate([-0.5 * H, 0.5 * H]):
-        n += 1
-        imove = -3
-        vx = 0.0
-        vy = 0.0
-        normal_x = 0
-        normal_y = 1 if i else -1
-        press = p0
-        dens = refd + (press - p0) / cs**2 
-        mass = dr
-        string = ("{} {}, " * 4 + "{}, {}, {}, {}, {}, {}\n").format(
-            x, y,
-            normal_x, normal_y,
-            vx, vy,
-            0.0, 0.0,
-            dens,
-            0.0,
-            mass,
-            imove,
-            0,
-            m_iters)
-        output.write(string)
-    x += dr
+x = -0.5 * dr - sep * h + np.arange(nx) * dr
+x, y = np.meshgrid(x, [-0.5 * H, 0.5 * H], indexing='ij')
+x = x.ravel()
+y = y.ravel()
+n_sym = writeParticles(output, x, y,
+                       normal_x=0.0,
+                       normal_y=np.sign(y),
+                       dens=dens,
+                       mass=dr,
+                       imove=-3)
+print('    {} elements'.format(n_sym))
+n += n_sym
 
 string = """
     Writing buffer particles...
 """
 print(string)
 
-Percentage = -1
+# All the buffer particles are equal, so the row is formatted just once
 x = domain_max[0] + sep * h
 y = domain_max[1] + sep * h
-for i in range(n_buffer):
-    percentage = int(round((i + 1.0) / n_buffer * 100))
-    if Percentage != percentage:
-        Percentage = percentage
-        if not Percentage % 10:
-            string = '    {}%'.format(Percentage)
-            print(string)
-    n += 1
-    imove = -255
-    vx = 0.0
-    vy = 0.0
-    press = 0.0
-    dens = refd
-    mass = refd * dr**2.0
-    string = ("{} {}, " * 4 + "{}, {}, {}, {}, {}, {}\n").format(
-        x, y,
-        0.0, 0.0,
-        vx, vy,
-        0.0, 0.0,
-        dens,
-        0.0,
-        mass,
-        imove,
-        0,
-        m_iters)
-    output.write(string)
+string = FMT % (x, y,
+                0.0, 0.0,
+                0.0, 0.0,
+                0.0, 0.0,
+                refd,
+                0.0,
+                refd * dr**2.0,
+                -255,
+                0,
+                m_iters) + '\n'
+output.write(string * n_buffer)
+print('    {} particles'.format(n_buffer))
+n += n_buffer
 output.close()
 print('{} particles written'.format(n))
 
 print("Opening cylinder boundary elements output file...")
-output = open("Cylinder.dat", "w")
+output = open("Cylinder.dat", "w", buffering=1 << 20)
 string = """#############################################################
 #                                                           #
 #    #    ##   #  #   #                           #         #
@@ -258,46 +248,19 @@ string = """
     Writing the boundary elements...
 """
 print(string)
-Percentage = -1
 level = 2
-theta = 0.0
 dtheta = 2.0 * (dr / (2**level)) / D
 n_cyl = int(round(2.0 * math.pi / dtheta))
 dtheta = 2.0 * math.pi / n_cyl
-n_cyl = 0  # Avoid rounding errors
-while theta < 2.0 * math.pi:
-    percentage = int(round(theta / (2.0 * math.pi) * 100))
-    if Percentage != percentage:
-        Percentage = percentage
-        if not Percentage % 10:
-            string = '    {}%'.format(Percentage)
-            print(string)
-
-    imove = -3
-    x = x_cyl + 0.5 * D * math.cos(theta)
-    y = y_cyl + 0.5 * D * math.sin(theta)
-    vx = 0.0
-    vy = 0.0
-    normal_x = -math.cos(theta)
-    normal_y = -math.sin(theta)
-    press = p0
-    dens = refd + (press - p0) / cs**2 
-    mass = dr / (2**level)
-    string = ("{} {}, " * 4 + "{}, {}, {}, {}, {}, {}\n").format(
-        x, y,
-        normal_x, normal_y,
-        vx, vy,
-        0.0, 0.0,
-        dens,
-        0.0,
-        mass,
-        imove,
-        0,
-        m_iters)
-    output.write(string)
-
-    n_cyl += 1
-    theta += dtheta
+theta = np.arange(n_cyl) * dtheta
+x = x_cyl + 0.5 * D * np.cos(theta)
+y = y_cyl + 0.5 * D * np.sin(theta)
+writeParticles(output, x, y,
+               normal_x=-np.cos(theta),
+               normal_y=-np.sin(theta),
+               dens=dens,
+               mass=dr / (2**level),
+               imove=-3)
 output.close()
 print('{} boundary elements written'.format(n_cyl))
 
@@ -328,15 +291,11 @@ data = {'DR':str(dr), 'HFAC':str(hfac), 'CS':str(cs), 'COURANT':str(courant),
         'COURANT_RAMP_ITERS':str(courant_ramp_iters),
         'COURANT_RAMP_FACTOR':str(courant_ramp_factor),
         'M_ITERS':str(m_iters)}
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
 for fname in XML:
     # Read the template
-    f = open(path.join(templates_path, fname), 'r')
-    txt = f.read()
-    f.close()
-    # Replace the data
-    for k in data.keys():
-        txt = txt.replace('{{' + k + '}}', data[k])
+    txt = Path(templates_path, fname).read_text()
+    # Replace the data, in a single pass
+    txt = PLACEHOLDER.sub(lambda m: data.get(m.group(1), m.group(0)), txt)
     # Write the file
-    f = open(fname, 'w')
-    f.write(txt)
-    f.close()
+    Path(fname).write_text(txt)
@@ -31,6 +31,7 @@
 
 import os
 from os import path
+import numpy as np
 from scipy.signal import savgol_filter
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
@@ -44,42 +45,73 @@ def readFile(filepath):
     if not path.isabs(filepath):
         abspath = path.join(path.dirname(path.abspath(__file__)), filepath)
     # Read the file by lines
-    f = open(abspath, "r")
-    lines = f.readlines()
-    f.close()
-    data = []
-    for l in lines[1:-1]:  # Skip the last line, which may be unready
-        l = l.strip()
-        while l.find('  ') != -1:
-            l = l.replace('  ', ' ')
-        fields = l.split(' ')
-        try:
-            data.append(map(float, fields))
-        except:
-            continue
+    with open(abspath, "r") as f:
+        lines = f.readlines()
+    # Skip the header, and the last line, which may be unready
+    lines = lines[1:-1]
+    if not lines:
+        return np.empty((0, 0))
     # Transpose the data
-    return [list(d) for d in zip(*data)]
+    return np.loadtxt(lines, ndmin=2).T
 
 
+def readTail(filepath):
+    """ Read and extract the data appended to a file since the last call
+    :param filepath File ot read
+    """
+    global tail_file, tail_line, data
+    abspath = filepath
+    if not path.isabs(filepath):
+        abspath = path.join(path.dirname(path.abspath(__file__)), filepath)
+    if tail_file is not None:
+        # If the simulation has been launched again, the file has been either
+        # truncated or replaced, so it shall be read from the beginning
+        stat = os.stat(abspath)
+        fstat = os.fstat(tail_file.fileno())
+        if stat.st_ino != fstat.st_ino or fstat.st_size < tail_file.tell():
+            tail_file.close()
+            tail_file = None
+            tail_line = ''
+            data = None
+    if tail_file is None:
+        tail_file = open(abspath, "r", buffering=1 << 17)
+    new_lines = (tail_line + tail_file.read()).split('\n')
+    # Keep the last line, which may be unready, for the next call
+    tail_line = new_lines.pop()
+    # Skip the header, as well as the blank lines
+    new_lines = [l for l in new_lines if l.strip() and not l.startswith('#')]
+    if not new_lines:
+        return np.empty((0, 0))
+    return np.loadtxt(new_lines, ndmin=2)
+
+
+tail_file = None
+tail_line = ''
+data = None
 lines = []
 
 
 def update(frame_index):
-    plt.tight_layout()
+    global data
     try:
-        data = readFile('sensors_0.out')
-        t = data[0]
-        pp = data[1:]
-    except IndexError:
-        return
+        new_data = readTail('sensors_0.out')
     except FileNotFoundError:
-        return
+        return lines
+    if not len(new_data):
+        return lines
+    if data is None:
+        data = new_data
+    else:
+        data = np.concatenate((data, new_data))
+    t = data[:, 0]
+    pp = data[:, 1:].T
     for i, p in enumerate(pp):
         try:
             lines[i].set_data(t, savgol_filter(p, 71, 3))
         except ValueError:
             # Not enough data yet
             lines[i].set_data(t, p)
+    return lines
 
 
 fig = plt.figure()
@@ -95,7 +127,28 @@ axes = (ax11, ax12, ax13, ax14,
         ax21, ax22, ax23, ax24)
 
 FNAME = path.join('@EXAMPLE_DEST_DIR@', 'test_case_2_exp_data.dat')
-T,P1,P2,P3,P4,P5,P6,P7,P8,_,_,_,_, = readFile(FNAME)
+# The experimental data is static, so it is parsed just once, and stored in a
+# binary file to be loaded the next times
+CACHE = path.splitext(FNAME)[0] + '.npy'
+exp_data = None
+if path.isfile(CACHE) and path.getmtime(CACHE) >= path.getmtime(FNAME):
+    try:
+        exp_data = np.load(CACHE)
+    except (OSError, ValueError, EOFError):
+        # Broken file, parse the data again
+        pass
+if exp_data is None:
+    exp_data = readFile(FNAME)
+    try:
+        # Write a temporary file first, so an interrupted write never leaves
+        # a broken file behind
+        with open(CACHE + '.tmp', 'wb') as f:
+            np.save(f, exp_data)
+        os.replace(CACHE + '.tmp', CACHE)
+    except OSError:
+        # Not writable, it will be parsed again the next time
+        pass
+T,P1,P2,P3,P4,P5,P6,P7,P8 = exp_data[:9]
 exp_t = T
 exp_p = (P1, P2, P3, P4, P5, P6, P7, P8)
 titles = ('P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7', 'P8')
@@ -131,6 +184,8 @@ for i, ax in enumerate(axes):
     else:
         plt.setp(ax.get_yticklabels(), visible=False)
 
+plt.tight_layout()
 update(0)
-ani = animation.FuncAnimation(fig, update, interval=5000)
+# Just the SPH lines are changing, so blit them over the static axes
+ani = animation.FuncAnimation(fig, update, interval=5000, blit=True)
 plt.show()